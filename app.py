@@ -1,10 +1,17 @@
 import streamlit as st
 import pandas as pd
+import numpy as np
 import plotly.express as px
 import plotly.graph_objects as go
-from typing import List
+import plotly.io as pio
+from typing import List, Tuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import timedelta
+import asyncio
+import io
 import time
 import os
+import re
 
 # Import our custom modules
 from database import FinancialDatabase
@@ -12,6 +19,21 @@ from data_collector import YahooFinanceCollector
 from financial_analyzer import FinancialAnalyzer
 from claude_integration import ClaudeAnalyst
 
+# Ticker symbols accepted from the input box: 1-5 letters
+SYMBOL_PATTERN = re.compile(r'[A-Za-z]{1,5}')
+
+# Maximum number of symbols fetched from Yahoo Finance concurrently
+MAX_FETCH_WORKERS = 8
+
+# Seconds to reuse Yahoo Finance responses before fetching them again
+YAHOO_CACHE_TTL = 3600
+
+# Analysis results younger than this are reused instead of refetched
+ANALYSIS_MAX_AGE = timedelta(hours=6)
+
+# Seconds to reuse loaded analysis results between reruns
+RESULTS_CACHE_TTL = 600
+
 # Page configuration
 st.set_page_config(
     page_title="AI Financial Analyst",
@@ -26,40 +48,107 @@ if 'analysis_complete' not in st.session_state:
 if 'analyzed_stocks' not in st.session_state:
     st.session_state.analyzed_stocks = []
 
+@st.cache_resource(show_spinner=False)
+def _create_components():
+    """Create the components once per process and reuse them across reruns"""
+    db = FinancialDatabase()
+    collector = YahooFinanceCollector()
+    analyzer = FinancialAnalyzer()
+    claude = ClaudeAnalyst()
+    return db, collector, analyzer, claude
+
 def initialize_components():
     """Initialize all components"""
     try:
-        db = FinancialDatabase()
-        collector = YahooFinanceCollector()
-        analyzer = FinancialAnalyzer()
-        claude = ClaudeAnalyst()
-        return db, collector, analyzer, claude
+        # Failures raise out of the cached function, so they are retried next rerun
+        return _create_components()
     except Exception as e:
         st.error(f"Error initializing components: {e}")
         st.info("Make sure you have set up your .env file with ANTHROPIC_API_KEY")
         return None, None, None, None
 
-def validate_and_clean_symbols(symbols_input: str) -> List[str]:
-    """Validate and clean stock symbols"""
+@st.cache_data(show_spinner=False)
+def validate_and_clean_symbols(symbols_input: str) -> Tuple[List[str], List[str]]:
+    """Validate and clean stock symbols, returning (valid, invalid) symbols"""
+    valid_symbols, invalid_symbols = [], []
+
     if not symbols_input:
-        return []
+        return valid_symbols, invalid_symbols
 
     # Split by comma and clean
-    symbols = [s.strip().upper() for s in symbols_input.split(',') if s.strip()]
-
-    # Basic validation
-    valid_symbols = []
-    for symbol in symbols:
-        if len(symbol) <= 5 and symbol.isalpha():
-            valid_symbols.append(symbol)
-        else:
-            st.warning(f"Skipping invalid symbol: {symbol}")
-
-    return valid_symbols
+    for symbol in symbols_input.split(','):
+        symbol = symbol.strip()
+        if symbol:
+            (valid_symbols if SYMBOL_PATTERN.fullmatch(symbol) else invalid_symbols).append(symbol.upper())
+
+    return valid_symbols, invalid_symbols
+
+def _format_column(values: pd.Series, fmt: str) -> pd.Series:
+    """Format a numeric column for display, showing N/A for missing values"""
+    formatted = values.map(fmt.format, na_action='ignore')
+    return formatted.where(values.notna(), "N/A")
+
+@st.cache_data(ttl=RESULTS_CACHE_TTL, show_spinner=False)
+def _load_results(_db: FinancialDatabase) -> pd.DataFrame:
+    """Load analysis results (cleared by run_analysis when new results are stored)"""
+    return _db.get_all_analysis_results()
+
+def _column_or_default(df: pd.DataFrame, column: str, default) -> pd.Series:
+    """Return a column, or a column of default values if the DataFrame lacks it"""
+    if column in df.columns:
+        return df[column]
+    return pd.Series(default, index=df.index)
+
+def _to_parquet(df: pd.DataFrame) -> bytes:
+    """Serialize a DataFrame to parquet bytes, used as a cache key for figures"""
+    return df.to_parquet(index=False)
+
+@st.cache_data(show_spinner=False)
+def _build_scores_figure(scores_parquet: bytes) -> str:
+    """Build the ranking score bar chart, serialized as a plotly JSON spec"""
+    scores_df = pd.read_parquet(io.BytesIO(scores_parquet))
+    fig = px.bar(
+        scores_df,
+        x='symbol',
+        y='ranking_score',
+        title="Stock Ranking Scores",
+        color='ranking_score',
+        color_continuous_scale='RdYlGn'
+    )
+    return pio.to_json(fig, validate=False)
+
+@st.cache_data(show_spinner=False)
+def _build_scatter_figure(scatter_parquet: bytes) -> str:
+    """Build the revenue growth vs EBIT margin scatter plot, serialized as a plotly JSON spec"""
+    valid_data = pd.read_parquet(io.BytesIO(scatter_parquet))
+    fig = px.scatter(
+        valid_data,
+        x='revenue_growth_4q',
+        y='avg_ebit_margin',
+        size='ranking_score',
+        color='ranking_score',
+        hover_name='symbol',
+        title="Quarterly Growth vs EBIT Margin",
+        color_continuous_scale='RdYlGn',
+        labels={'revenue_growth_4q': 'Revenue Growth QoQ (%)', 'avg_ebit_margin': 'EBIT Margin (%)'}
+    )
+    return pio.to_json(fig, validate=False)
+
+async def _generate_ai_reports(claude: ClaudeAnalyst, results_df: pd.DataFrame, model: str,
+                              recommendation_placeholder, strategy_placeholder):
+    """Generate the investment recommendation and portfolio strategy concurrently"""
+    return await asyncio.gather(
+        claude.generate_investment_recommendation(
+            results_df, model=model, on_text=recommendation_placeholder.markdown
+        ),
+        claude.generate_portfolio_strategy(
+            results_df, model=model, on_text=strategy_placeholder.markdown
+        )
+    )
 
 def display_analysis_results(db: FinancialDatabase, claude: ClaudeAnalyst):
     """Display the analysis results"""
-    results_df = db.get_all_analysis_results()
+    results_df = _load_results(db)
 
     if results_df.empty:
         st.info("No analysis results available. Please analyze some stocks first.")
@@ -75,21 +164,14 @@ def display_analysis_results(db: FinancialDatabase, claude: ClaudeAnalyst):
     display_df['Rank'] = range(1, len(display_df) + 1)
 
     # Format columns for display
-    display_df['Revenue Growth'] = display_df['revenue_growth_4q'].apply(
-        lambda x: f"{x:.1f}%" if pd.notna(x) else "N/A"
-    )
-    display_df['Avg EBIT Margin'] = display_df['avg_ebit_margin'].apply(
-        lambda x: f"{x:.1f}%" if pd.notna(x) else "N/A"
-    )
-    display_df['Score'] = display_df['ranking_score'].apply(
-        lambda x: f"{x:.1f}" if pd.notna(x) else "N/A"
-    )
+    display_df['Revenue Growth'] = _format_column(display_df['revenue_growth_4q'], "{:.1f}%")
+    display_df['Avg EBIT Margin'] = _format_column(display_df['avg_ebit_margin'], "{:.1f}%")
+    display_df['Score'] = _format_column(display_df['ranking_score'], "{:.1f}")
 
     # Add simplified analysis columns
-    display_df['MA50 Rising'] = results_df.apply(
-        lambda row: "✓" if row.get('ma50_rising') else "✗", axis=1
-    )
-    display_df['Recommendation'] = results_df.get('recommendation', 'N/A')
+    ma50_rising = _column_or_default(results_df, 'ma50_rising', False)
+    display_df['MA50 Rising'] = np.where(ma50_rising.fillna(False).astype(bool), "✓", "✗")
+    display_df['Recommendation'] = _column_or_default(results_df, 'recommendation', 'N/A').fillna('N/A')
 
     # Select columns for display
     table_df = display_df[['Rank', 'symbol', 'Revenue Growth', 'Avg EBIT Margin',
@@ -104,13 +186,8 @@ def display_analysis_results(db: FinancialDatabase, claude: ClaudeAnalyst):
 
     with col1:
         st.subheader("Ranking Scores")
-        fig_scores = px.bar(
-            results_df,
-            x='symbol',
-            y='ranking_score',
-            title="Stock Ranking Scores",
-            color='ranking_score',
-            color_continuous_scale='RdYlGn'
+        fig_scores = pio.from_json(
+            _build_scores_figure(_to_parquet(results_df[['symbol', 'ranking_score']]))
         )
         st.plotly_chart(fig_scores, use_container_width=True)
 
@@ -124,17 +201,9 @@ def display_analysis_results(db: FinancialDatabase, claude: ClaudeAnalyst):
         ].copy()
 
         if not valid_data.empty:
-            fig_scatter = px.scatter(
-                valid_data,
-                x='revenue_growth_4q',
-                y='avg_ebit_margin',
-                size='ranking_score',
-                color='ranking_score',
-                hover_name='symbol',
-                title="Quarterly Growth vs EBIT Margin",
-                color_continuous_scale='RdYlGn',
-                labels={'revenue_growth_4q': 'Revenue Growth QoQ (%)', 'avg_ebit_margin': 'EBIT Margin (%)'}
-            )
+            fig_scatter = pio.from_json(_build_scatter_figure(_to_parquet(
+                valid_data[['symbol', 'revenue_growth_4q', 'avg_ebit_margin', 'ranking_score']]
+            )))
             st.plotly_chart(fig_scatter, use_container_width=True)
         else:
             st.info("No valid data available for visualization")
@@ -148,28 +217,88 @@ def display_analysis_results(db: FinancialDatabase, claude: ClaudeAnalyst):
                 # Get selected model from session state
                 selected_model = st.session_state.get('selected_claude_model', 'claude-3-haiku-20240307')
 
-                # Convert dataframe to list of dicts for Claude
-                stocks_data = results_df.to_dict('records')
-                recommendation = claude.generate_investment_recommendation(stocks_data, model=selected_model)
-                st.write(recommendation)
+                recommendation_placeholder = st.empty()
+                st.subheader("Portfolio Strategy")
+                strategy_placeholder = st.empty()
+
+                # Both reports stream into the page as tokens arrive
+                recommendation, strategy = asyncio.run(_generate_ai_reports(
+                    claude, results_df, selected_model,
+                    recommendation_placeholder, strategy_placeholder
+                ))
+                recommendation_placeholder.markdown(recommendation)
+                strategy_placeholder.markdown(strategy)
 
                 # Show which model was used
                 st.info(f"Generated using: {selected_model}")
             except Exception as e:
                 st.error(f"Error generating recommendation: {e}")
 
+class _IncompleteFetch(Exception):
+    """
+    Raised out of a cached fetch when some data is missing. st.cache_data does not
+    cache exceptions, so a failed fetch is retried next time instead of being
+    reused for the whole TTL; the partial result travels with the exception.
+    """
+    def __init__(self, result):
+        super().__init__("incomplete fetch")
+        self.result = result
+
+def _uncached_on_failure(fetch):
+    """Wrap a cached fetch so a failed (uncached) result is returned as usual"""
+    def wrapper(*args):
+        try:
+            return fetch(*args)
+        except _IncompleteFetch as e:
+            return e.result
+    wrapper.clear = fetch.clear
+    return wrapper
+
+@_uncached_on_failure
+@st.cache_data(ttl=YAHOO_CACHE_TTL, show_spinner=False)
+def _collect_one(_collector: YahooFinanceCollector, symbol: str, include_balance_sheet: bool):
+    """Fetch stock info and fundamentals for one symbol (runs in a worker thread)"""
+    stock_info = _collector.get_stock_info(symbol)
+    fundamental_data = _collector.get_fundamental_data(symbol, include_balance_sheet)
+    if fundamental_data.empty:
+        raise _IncompleteFetch((stock_info, fundamental_data))
+    return stock_info, fundamental_data
+
+@_uncached_on_failure
+@st.cache_data(ttl=YAHOO_CACHE_TTL, show_spinner=False)
+def _collect_prices(_collector: YahooFinanceCollector, symbols: List[str]):
+    """Fetch daily price data and current prices for all symbols in one batch"""
+    price_data = _collector.get_daily_price_data_bulk(symbols)
+    if any(data['current_price'] is None for data in price_data.values()):
+        raise _IncompleteFetch(price_data)
+    return price_data
+
 def run_analysis(symbols: List[str], db: FinancialDatabase,
-                collector: YahooFinanceCollector, analyzer: FinancialAnalyzer):
+                collector: YahooFinanceCollector, analyzer: FinancialAnalyzer,
+                include_balance_sheet: bool = False, force_refresh: bool = False):
     """Run the complete analysis workflow"""
 
-    # Clear existing database and start fresh
-    with st.spinner("Clearing database and preparing for fresh analysis..."):
-        db.clear_database()
+    if force_refresh:
+        # Drop cached Yahoo Finance responses so every symbol is fetched again
+        _collect_one.clear()
+        _collect_prices.clear()
+
+    # Reuse recent results and only fetch symbols that are new or stale
+    with st.spinner("Checking for existing analysis..."):
+        existing = set() if force_refresh else set(db.get_analyzed_symbols(fresher_than=ANALYSIS_MAX_AGE))
+        reused = [symbol for symbol in symbols if symbol in existing]
+        symbols = [symbol for symbol in symbols if symbol not in existing]
+
+        # Remove symbols no longer requested, and old data for symbols being refreshed
+        db.delete_stocks((set(db.get_all_symbols()) - set(reused)) | set(symbols))
+
+    if reused:
+        st.info(f"Reusing recent analysis for: {', '.join(reused)}")
 
     progress_bar = st.progress(0)
     status_text = st.empty()
 
-    total_steps = len(symbols) * 3 + 1  # Fundamental + Technical + Analysis + Final ranking
+    total_steps = len(symbols) * 3 + 1  # Fetch + Store + Analysis + Final ranking
 
     step = 0
 
@@ -177,50 +306,73 @@ def run_analysis(symbols: List[str], db: FinancialDatabase,
     status_text.text("Collecting fundamental and technical data...")
     collected_data = {}
 
-    for i, symbol in enumerate(symbols):
-        status_text.text(f"Collecting data for {symbol}...")
-
-        # Get stock info and add to database
-        stock_info = collector.get_stock_info(symbol)
-        db.add_stock(symbol, stock_info.get('company_name'))
+    # Per-symbol status messages, written to the page in one update after collection
+    log_container = st.container()
+    collection_log = []
+
+    # Yahoo Finance calls are blocking network round-trips, so fetch all symbols
+    # concurrently. Database writes stay on this thread and only start once every
+    # fetch has finished, so the write transaction stays short.
+    fetched = {}
+    with ThreadPoolExecutor(max_workers=MAX_FETCH_WORKERS) as executor:
+        # Price history for every symbol comes from one batched download,
+        # which runs alongside the per-symbol fundamental fetches
+        prices_future = executor.submit(_collect_prices, collector, symbols)
+        futures = {executor.submit(_collect_one, collector, symbol, include_balance_sheet): symbol
+                   for symbol in symbols}
+
+        for future in as_completed(futures):
+            symbol = futures[future]
+            status_text.text(f"Collected data for {symbol}...")
 
-        # Get fundamental data (quarterly)
-        fundamental_data = collector.get_fundamental_data(symbol)
+            try:
+                fetched[symbol] = future.result()
+            except Exception as e:
+                # Carry on without fundamentals rather than losing the other symbols
+                collection_log.append(f"⚠️ Error collecting data for {symbol}: {e}")
+                fetched[symbol] = ({'symbol': symbol, 'company_name': symbol}, pd.DataFrame())
 
-        # Get technical data (daily prices with moving averages)
-        technical_data = collector.get_daily_price_data(symbol)
+            step += 1
+            progress_bar.progress(step / total_steps)
 
-        # Get current price
-        current_price = collector.get_current_price(symbol)
+        price_data = prices_future.result()
+
+    # Commit all of the collected data in a single transaction
+    status_text.text("Storing collected data...")
+    with db.batch():
+        for symbol, (stock_info, fundamental_data) in fetched.items():
+            technical_data = price_data[symbol]['price_data']
+            current_price = price_data[symbol]['current_price']
+            db.add_stock(symbol, stock_info.get('company_name'))
+
+            if not fundamental_data.empty:
+                db.store_fundamental_data(symbol, fundamental_data)
+                collected_data[symbol] = {
+                    'fundamental': fundamental_data,
+                    'technical': technical_data,
+                    'current_price': current_price
+                }
+                collection_log.append(f"✅ Fundamental data collected for {symbol}")
+            else:
+                collection_log.append(f"⚠️ No fundamental data available for {symbol}")
+                collected_data[symbol] = {
+                    'fundamental': pd.DataFrame(),
+                    'technical': pd.DataFrame(),
+                    'current_price': current_price
+                }
+
+            # Store technical data if available
+            if not technical_data.empty:
+                db.store_technical_data(symbol, technical_data)
+                collection_log.append(f"✅ Technical data collected for {symbol}")
+            else:
+                collection_log.append(f"⚠️ No technical data available for {symbol}")
 
-        if fundamental_data:
-            db.store_fundamental_data(symbol, fundamental_data)
-            collected_data[symbol] = {
-                'fundamental': fundamental_data,
-                'technical': technical_data,
-                'current_price': current_price
-            }
-            st.success(f"✅ Fundamental data collected for {symbol}")
-        else:
-            st.warning(f"⚠️ No fundamental data available for {symbol}")
-            collected_data[symbol] = {
-                'fundamental': [],
-                'technical': pd.DataFrame(),
-                'current_price': current_price
-            }
-
-        step += 1
-        progress_bar.progress(step / total_steps)
-
-        # Store technical data if available
-        if not technical_data.empty:
-            db.store_technical_data(symbol, technical_data)
-            st.success(f"✅ Technical data collected for {symbol}")
-        else:
-            st.warning(f"⚠️ No technical data available for {symbol}")
+            step += 1
+            progress_bar.progress(step / total_steps)
 
-        step += 1
-        progress_bar.progress(step / total_steps)
+    if collection_log:
+        log_container.markdown("  \n".join(collection_log))
 
     # Analysis Phase
     status_text.text("Performing financial and technical analysis...")
@@ -241,12 +393,12 @@ def run_analysis(symbols: List[str], db: FinancialDatabase,
             )
             analysis_results.append(analysis)
 
-            # Store in database
-            db.store_analysis_result(symbol, analysis)
-
             step += 1
             progress_bar.progress(step / total_steps)
 
+    # Store all analysis results in one statement
+    db.store_analysis_results_batch(analysis_results)
+
     # Ranking Phase
     status_text.text("Ranking stocks...")
     if analysis_results:
@@ -256,6 +408,9 @@ def run_analysis(symbols: List[str], db: FinancialDatabase,
     step += 1
     progress_bar.progress(1.0)
 
+    # New results are in the database, so drop the cached copy
+    _load_results.clear()
+
     status_text.text("Analysis complete!")
     st.session_state.analysis_complete = True
 
@@ -283,6 +438,18 @@ def main():
 
         st.markdown("**Example symbols:** AAPL, MSFT, GOOGL, TSLA, NVDA, META, AMZN")
 
+        include_balance_sheet = st.checkbox(
+            "Include balance sheet metrics",
+            value=False,
+            help="Also fetch quarterly balance sheets (total assets, debt, equity, cash, ROE). Adds one request per stock."
+        )
+
+        force_refresh = st.checkbox(
+            "Refetch all data",
+            value=False,
+            help="Ignore recent analysis results and cached Yahoo Finance data, and fetch every stock again."
+        )
+
         analyze_button = st.button("🚀 Analyze Stocks", type="primary")
 
         st.markdown("---")
@@ -324,7 +491,10 @@ def main():
 
     # Main content area
     if analyze_button:
-        symbols = validate_and_clean_symbols(symbols_input)
+        symbols, invalid_symbols = validate_and_clean_symbols(symbols_input)
+
+        for symbol in invalid_symbols:
+            st.warning(f"Skipping invalid symbol: {symbol}")
 
         if not symbols:
             st.error("Please enter valid stock symbols (e.g., AAPL, MSFT)")
@@ -333,7 +503,7 @@ def main():
 
             # Run analysis
             with st.container():
-                run_analysis(symbols, db, collector, analyzer)
+                run_analysis(symbols, db, collector, analyzer, include_balance_sheet, force_refresh)
 
     # Display results if analysis is complete
     if st.session_state.analysis_complete:
@@ -1,19 +1,52 @@
 import os
-from typing import Dict, List, Any
+from typing import Dict, Any, Callable, Optional
 import anthropic
+import pandas as pd
 from dotenv import load_dotenv
 
-# Load environment variables
-load_dotenv()
+# Whether the .env file has been loaded into the environment
+_env_loaded = False
+
+# Analysis result columns included in the summary sent to Claude
+SUMMARY_COLUMNS = ['symbol', 'rank', 'revenue_growth_3yr', 'avg_ebit_margin',
+                   'ebit_margin_trend', 'ranking_score']
+
+# Output tokens reserved per stock covered by an investment recommendation
+TOKENS_PER_STOCK = 300
+
+_ANALYST_SYSTEM = "You are a financial analyst."
+
+_INVESTMENT_PROMPT = """Provide an investment recommendation based on the stock analysis data above.
+
+Cover: 1. Buy/Hold/Avoid recommendation for each stock 2. Portfolio allocation if investing in multiple stocks 3. Key risks and opportunities 4. Summary rationale. Format as a professional investment report for an investment committee.
+"""
+
+_PORTFOLIO_PROMPT = """Acting as a portfolio manager, create an investment strategy for a ${investment_amount:,.0f} portfolio based on the top-ranked stocks above.
+
+Provide:
+1. Recommended portfolio allocation (% for each stock)
+2. Rationale for allocation weights
+3. Risk management considerations
+4. Rebalancing timeline recommendations
+5. Expected portfolio characteristics (growth vs value, risk level)
+
+Format as a professional portfolio strategy document.
+"""
 
 class ClaudeAnalyst:
     def __init__(self, api_key: str = None):
         """
         Initialize Claude integration for investment recommendations
         """
+        global _env_loaded
+
         if api_key:
             self.api_key = api_key
         else:
+            # Load environment variables
+            if not _env_loaded:
+                load_dotenv()
+                _env_loaded = True
             self.api_key = os.getenv('ANTHROPIC_API_KEY')
 
         if not self.api_key:
@@ -21,40 +54,57 @@ class ClaudeAnalyst:
 
         self.client = anthropic.Anthropic(api_key=self.api_key)
 
-    def generate_investment_recommendation(self, ranked_stocks: List[Dict[str, Any]], model: str = "claude-3-haiku-20240307") -> str:
-        """
-        Generate investment recommendation using Claude based on stock analysis
+    async def _stream_completion(self, model: str, max_tokens: int, prompt: str,
+                                 on_text: Optional[Callable[[str], None]] = None,
+                                 context: Optional[str] = None) -> str:
         """
-        # Prepare the analysis data for Claude
-        analysis_summary = self._prepare_analysis_summary(ranked_stocks)
+        Stream a completion from Claude, passing the text received so far to
+        on_text as tokens arrive, and return the full response text.
 
-        prompt = f"""
-As a financial analyst, please provide an investment recommendation based on the following stock analysis data:
-
-{analysis_summary}
-
-Please provide:
-1. An overall investment recommendation (Buy, Hold, or Avoid) for each stock
-2. A portfolio allocation suggestion if investing in multiple stocks
-3. Key risks and opportunities identified
-4. Summary rationale for your recommendations
-
-Please format your response as a professional investment report suitable for presentation to investment committee.
-"""
-
-        try:
-            response = self.client.messages.create(
+        context is the data the prompt refers to (e.g. the analysis summary); it
+        is sent as its own block ahead of the prompt.
+        """
+        content = []
+        if context:
+            content.append({"type": "text", "text": context})
+        content.append({"type": "text", "text": prompt})
+
+        text = ""
+        # Async connection pools are bound to the event loop that opened them, and
+        # each asyncio.run() has a new loop, so the client is opened per request
+        async with anthropic.AsyncAnthropic(api_key=self.api_key) as aclient:
+            async with aclient.messages.stream(
                 model=model,
-                max_tokens=2000,
+                max_tokens=max_tokens,
+                system=_ANALYST_SYSTEM,
                 messages=[
                     {
                         "role": "user",
-                        "content": prompt
+                        "content": content
                     }
                 ]
-            )
+            ) as stream:
+                async for chunk in stream.text_stream:
+                    text += chunk
+                    if on_text:
+                        on_text(text)
 
-            return response.content[0].text
+        return text
+
+    async def generate_investment_recommendation(self, ranked_stocks: pd.DataFrame,
+                                                 model: str = "claude-3-haiku-20240307",
+                                                 on_text: Optional[Callable[[str], None]] = None) -> str:
+        """
+        Generate investment recommendation using Claude based on stock analysis
+        """
+        # Prepare the analysis data for Claude
+        analysis_summary = self._prepare_analysis_summary(ranked_stocks)
+
+        try:
+            # Size the generation budget to the number of stocks being covered
+            max_tokens = min(2000, TOKENS_PER_STOCK * max(len(ranked_stocks), 1))
+            return await self._stream_completion(model, max_tokens, _INVESTMENT_PROMPT, on_text,
+                                                 context=analysis_summary)
 
         except Exception as e:
             error_msg = f"Claude API Error: {str(e)}"
@@ -67,7 +117,7 @@ Please format your response as a professional investment report suitable for pre
         Generate a detailed summary for an individual stock
         """
         prompt = f"""
-As a financial analyst, provide a detailed investment analysis for the following stock:
+Provide a detailed investment analysis for the following stock:
 
 Stock Symbol: {stock_analysis['symbol']}
 3-Year Revenue Growth (CAGR): {stock_analysis.get('revenue_growth_3yr', 'N/A')}%
@@ -91,6 +141,7 @@ Keep the analysis concise but professional.
             response = self.client.messages.create(
                 model="claude-3-sonnet-20240229",
                 max_tokens=1000,
+                system=_ANALYST_SYSTEM,
                 messages=[
                     {
                         "role": "user",
@@ -104,57 +155,43 @@ Keep the analysis concise but professional.
         except Exception as e:
             return f"Error generating stock summary: {str(e)}"
 
-    def _prepare_analysis_summary(self, ranked_stocks: List[Dict[str, Any]]) -> str:
+    def _prepare_analysis_summary(self, ranked_stocks: pd.DataFrame) -> str:
         """
         Prepare a formatted summary of all stock analyses for Claude
         """
         summary_lines = ["STOCK ANALYSIS SUMMARY", "=" * 50, ""]
 
-        for stock in ranked_stocks:
+        # Columns the summary needs; any the results lack are reported as N/A.
+        # Stored values are unrounded, so round them for the prompt here.
+        summary_df = ranked_stocks.reindex(columns=SUMMARY_COLUMNS).round(2).astype(object)
+        summary_df = summary_df.where(summary_df.notna(), 'N/A')
+
+        for symbol, rank, revenue_growth, avg_margin, margin_trend, score in summary_df.itertuples(index=False):
             summary_lines.extend([
-                f"Stock: {stock['symbol']} (Rank #{stock.get('rank', 'N/A')})",
-                f"  3-Year Revenue Growth: {stock.get('revenue_growth_3yr', 'N/A')}%",
-                f"  Average EBIT Margin: {stock.get('avg_ebit_margin', 'N/A')}%",
-                f"  EBIT Margin Trend: {stock.get('ebit_margin_trend', 'N/A')}",
-                f"  Overall Score: {stock.get('ranking_score', 'N/A')}/100",
+                f"Stock: {symbol} (Rank #{rank})",
+                f"  3-Year Revenue Growth: {revenue_growth}%",
+                f"  Average EBIT Margin: {avg_margin}%",
+                f"  EBIT Margin Trend: {margin_trend}",
+                f"  Overall Score: {score}/100",
                 ""
             ])
 
         return "\n".join(summary_lines)
 
-    def generate_portfolio_strategy(self, top_stocks: List[Dict[str, Any]],
-                                  investment_amount: float = 100000) -> str:
+    async def generate_portfolio_strategy(self, top_stocks: pd.DataFrame,
+                                          investment_amount: float = 100000,
+                                          model: str = "claude-3-sonnet-20240229",
+                                          on_text: Optional[Callable[[str], None]] = None) -> str:
         """
         Generate a portfolio allocation strategy
         """
-        prompt = f"""
-As a portfolio manager, create an investment strategy for a ${investment_amount:,.0f} portfolio based on these top-ranked stocks:
-
-{self._prepare_analysis_summary(top_stocks[:5])}  # Top 5 stocks only
-
-Provide:
-1. Recommended portfolio allocation (% for each stock)
-2. Rationale for allocation weights
-3. Risk management considerations
-4. Rebalancing timeline recommendations
-5. Expected portfolio characteristics (growth vs value, risk level)
-
-Format as a professional portfolio strategy document.
-"""
+        # Top 5 stocks only
+        analysis_summary = self._prepare_analysis_summary(top_stocks.head(5))
+        prompt = _PORTFOLIO_PROMPT.format(investment_amount=investment_amount)
 
         try:
-            response = self.client.messages.create(
-                model="claude-3-sonnet-20240229",
-                max_tokens=1500,
-                messages=[
-                    {
-                        "role": "user",
-                        "content": prompt
-                    }
-                ]
-            )
-
-            return response.content[0].text
+            return await self._stream_completion(model, 1500, prompt, on_text,
+                                                 context=analysis_summary)
 
         except Exception as e:
             return f"Error generating portfolio strategy: {str(e)}"
\ No newline at end of file
@@ -2,8 +2,21 @@ import yfinance as yf
 import pandas as pd
 from typing import List, Dict, Any, Optional
 from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import numpy as np
 
+# Candidate row names for each metric in Yahoo Finance statements, in order of preference
+REVENUE_KEYS = ['Total Revenue', 'Revenue', 'Net Sales', 'Total Net Sales']
+EBIT_KEYS = ['Operating Income', 'EBIT', 'Operating Revenue', 'Income From Operations']
+NET_INCOME_KEYS = ['Net Income', 'Net Income Common Stockholders', 'Net Income Continuing Operations']
+TOTAL_ASSETS_KEYS = ['Total Assets', 'Total Asset']
+TOTAL_DEBT_KEYS = ['Total Debt', 'Long Term Debt', 'Net Debt']
+EQUITY_KEYS = ['Stockholders Equity', 'Total Stockholder Equity', 'Shareholders Equity']
+CASH_KEYS = ['Cash And Cash Equivalents', 'Cash', 'Cash Cash Equivalents And Short Term Investments']
+
+# Moving average windows (trading days) added to daily price data
+MOVING_AVERAGE_WINDOWS = (20, 50, 200)
+
 class YahooFinanceCollector:
     def __init__(self):
         self.current_year = datetime.now().year
@@ -23,170 +36,80 @@ class YahooFinanceCollector:
             print(f"Error fetching info for {symbol}: {e}")
             return {'symbol': symbol.upper(), 'company_name': symbol}
 
-    def get_fundamental_data(self, symbol: str) -> List[Dict[str, Any]]:
+    def get_fundamental_data(self, symbol: str, include_balance_sheet: bool = False) -> pd.DataFrame:
         """
-        Collect last 4 quarters of fundamental data
+        Collect last 4 quarters of fundamental data (missing values are NaN).
+        Balance sheet items (and the ratios derived from them) are only
+        fetched when include_balance_sheet is set.
         """
         try:
             stock = yf.Ticker(symbol)
 
             # Get quarterly financial statements
             quarterly_financials = stock.quarterly_financials
-            quarterly_balance_sheet = stock.quarterly_balance_sheet
+            # The balance sheet is a separate request; skip it unless asked for
+            quarterly_balance_sheet = stock.quarterly_balance_sheet if include_balance_sheet else pd.DataFrame()
 
             if quarterly_financials.empty:
                 print(f"No quarterly financial data available for {symbol}")
-                return []
-
-            fundamental_data = []
+                return pd.DataFrame()
 
             # Get the last 4 quarters of data
             quarters = quarterly_financials.columns[:4]  # Most recent 4 quarters
-
-            for quarter in quarters:
-                # Get financial statement data
-                income_data = quarterly_financials[quarter] if quarter in quarterly_financials.columns else pd.Series()
-                balance_data = quarterly_balance_sheet[quarter] if quarter in quarterly_balance_sheet.columns else pd.Series()
-
-                # Extract financial metrics
-                revenue = self._extract_revenue(income_data)
-                operating_income = self._extract_ebit(income_data)
-                net_income = self._extract_net_income(income_data)
-
-                # Balance sheet items
-                total_assets = self._extract_total_assets(balance_data)
-                total_debt = self._extract_total_debt(balance_data)
-                shareholders_equity = self._extract_shareholders_equity(balance_data)
-                cash_and_equivalents = self._extract_cash(balance_data)
-
-                # Calculate ratios
-                ebit_margin = (operating_income / revenue * 100) if revenue and operating_income else None
-                roe = (net_income / shareholders_equity * 100) if net_income and shareholders_equity else None
-                debt_to_equity = (total_debt / shareholders_equity) if total_debt and shareholders_equity else None
-
-                # Determine quarter and year
-                quarter_str = f"Q{quarter.quarter}"
-                year = quarter.year
-
-                fundamental_data.append({
-                    'quarter': quarter_str,
-                    'year': year,
-                    'revenue': revenue,
-                    'operating_income': operating_income,
-                    'net_income': net_income,
-                    'total_assets': total_assets,
-                    'total_debt': total_debt,
-                    'shareholders_equity': shareholders_equity,
-                    'cash_and_equivalents': cash_and_equivalents,
-                    'ebit_margin': ebit_margin,
-                    'roe': roe,
-                    'debt_to_equity': debt_to_equity
-                })
+            income_data = quarterly_financials[quarters]
+            balance_data = quarterly_balance_sheet.reindex(columns=quarters)
+
+            # Extract financial metrics for all quarters at once
+            revenue = self._extract_metric(income_data, REVENUE_KEYS)
+            operating_income = self._extract_metric(income_data, EBIT_KEYS)
+            net_income = self._extract_metric(income_data, NET_INCOME_KEYS)
+
+            # Balance sheet items
+            total_assets = self._extract_metric(balance_data, TOTAL_ASSETS_KEYS)
+            total_debt = self._extract_metric(balance_data, TOTAL_DEBT_KEYS)
+            shareholders_equity = self._extract_metric(balance_data, EQUITY_KEYS)
+            cash_and_equivalents = self._extract_metric(balance_data, CASH_KEYS)
+
+            # Calculate ratios (undefined when either side is missing or zero)
+            ebit_margin = (operating_income / revenue * 100).where(
+                self._nonzero(revenue) & self._nonzero(operating_income))
+            roe = (net_income / shareholders_equity * 100).where(
+                self._nonzero(net_income) & self._nonzero(shareholders_equity))
+            debt_to_equity = (total_debt / shareholders_equity).where(
+                self._nonzero(total_debt) & self._nonzero(shareholders_equity))
+
+            # One row per quarter, most recent first
+            fundamental_data = pd.DataFrame({
+                'quarter': [f"Q{quarter.quarter}" for quarter in quarters],
+                'year': [quarter.year for quarter in quarters],
+                'revenue': revenue.to_numpy(),
+                'operating_income': operating_income.to_numpy(),
+                'net_income': net_income.to_numpy(),
+                'total_assets': total_assets.to_numpy(),
+                'total_debt': total_debt.to_numpy(),
+                'shareholders_equity': shareholders_equity.to_numpy(),
+                'cash_and_equivalents': cash_and_equivalents.to_numpy(),
+                'ebit_margin': ebit_margin.to_numpy(),
+                'roe': roe.to_numpy(),
+                'debt_to_equity': debt_to_equity.to_numpy()
+            })
 
             return fundamental_data
 
         except Exception as e:
             print(f"Error fetching fundamental data for {symbol}: {e}")
-            return []
-
-    def _extract_revenue(self, year_data: pd.Series) -> Optional[float]:
-        """Extract revenue from financial data"""
-        revenue_keys = [
-            'Total Revenue',
-            'Revenue',
-            'Net Sales',
-            'Total Net Sales'
-        ]
-
-        for key in revenue_keys:
-            if key in year_data.index and pd.notna(year_data[key]):
-                return float(year_data[key])
-
-        return None
-
-    def _extract_ebit(self, data: pd.Series) -> Optional[float]:
-        """Extract EBIT (Operating Income) from financial data"""
-        ebit_keys = [
-            'Operating Income',
-            'EBIT',
-            'Operating Revenue',
-            'Income From Operations'
-        ]
-
-        for key in ebit_keys:
-            if key in data.index and pd.notna(data[key]):
-                return float(data[key])
-
-        return None
-
-    def _extract_net_income(self, data: pd.Series) -> Optional[float]:
-        """Extract net income from financial data"""
-        net_income_keys = [
-            'Net Income',
-            'Net Income Common Stockholders',
-            'Net Income Continuing Operations'
-        ]
-
-        for key in net_income_keys:
-            if key in data.index and pd.notna(data[key]):
-                return float(data[key])
-
-        return None
-
-    def _extract_total_assets(self, data: pd.Series) -> Optional[float]:
-        """Extract total assets from balance sheet data"""
-        assets_keys = [
-            'Total Assets',
-            'Total Asset'
-        ]
-
-        for key in assets_keys:
-            if key in data.index and pd.notna(data[key]):
-                return float(data[key])
-
-        return None
-
-    def _extract_total_debt(self, data: pd.Series) -> Optional[float]:
-        """Extract total debt from balance sheet data"""
-        debt_keys = [
-            'Total Debt',
-            'Long Term Debt',
-            'Net Debt'
-        ]
-
-        for key in debt_keys:
-            if key in data.index and pd.notna(data[key]):
-                return float(data[key])
-
-        return None
-
-    def _extract_shareholders_equity(self, data: pd.Series) -> Optional[float]:
-        """Extract shareholders equity from balance sheet data"""
-        equity_keys = [
-            'Stockholders Equity',
-            'Total Stockholder Equity',
-            'Shareholders Equity'
-        ]
-
-        for key in equity_keys:
-            if key in data.index and pd.notna(data[key]):
-                return float(data[key])
-
-        return None
-
-    def _extract_cash(self, data: pd.Series) -> Optional[float]:
-        """Extract cash and cash equivalents from balance sheet data"""
-        cash_keys = [
-            'Cash And Cash Equivalents',
-            'Cash',
-            'Cash Cash Equivalents And Short Term Investments'
-        ]
-
-        for key in cash_keys:
-            if key in data.index and pd.notna(data[key]):
-                return float(data[key])
-
-        return None
+            return pd.DataFrame()
+
+    def _extract_metric(self, statement: pd.DataFrame, keys: List[str]) -> pd.Series:
+        """
+        Extract a metric for every quarter of a financial statement, taking
+        the first of the candidate row names that has a value in each quarter
+        """
+        return statement.reindex(keys).astype(float).bfill().iloc[0]
+
+    def _nonzero(self, values: pd.Series) -> pd.Series:
+        """Mask of quarters where a metric is present and non-zero"""
+        return values.notna() & (values != 0)
 
     def validate_symbols(self, symbols: List[str]) -> List[str]:
         """Validate that stock symbols exist and return valid ones"""
@@ -223,20 +146,89 @@ class YahooFinanceCollector:
                 print(f"No price data available for {symbol}")
                 return pd.DataFrame()
 
-            # Calculate moving averages
-            hist['MA_20'] = hist['Close'].rolling(window=20).mean()
-            hist['MA_50'] = hist['Close'].rolling(window=50).mean()
-            hist['MA_200'] = hist['Close'].rolling(window=200).mean()
-
-            # Clean up the dataframe
-            hist = hist.dropna(subset=['MA_200'])  # Only keep rows with 200-day MA calculated
-
-            return hist
+            return self._add_moving_averages(hist)
 
         except Exception as e:
             print(f"Error fetching price data for {symbol}: {e}")
             return pd.DataFrame()
 
+    def get_daily_price_data_bulk(self, symbols: List[str], years: int = 4) -> Dict[str, Dict[str, Any]]:
+        """
+        Get daily price data with moving averages and the current price for
+        several stocks using a single batched Yahoo Finance download
+        """
+        results = {symbol.upper(): {'price_data': pd.DataFrame(), 'current_price': None}
+                   for symbol in symbols}
+
+        if not symbols:
+            return results
+
+        # Explicit date window, computed the same way as in get_daily_price_data
+        end_date = datetime.now()
+        start_date = end_date - timedelta(days=years*365)
+
+        try:
+            raw = yf.download(
+                tickers=" ".join(results.keys()),
+                start=start_date,
+                end=end_date,
+                interval="1d",
+                group_by='ticker',
+                threads=True,
+                auto_adjust=False,
+                progress=False
+            )
+        except Exception as e:
+            print(f"Error downloading price data for {', '.join(results.keys())}: {e}")
+            return results
+
+        if raw.empty:
+            print(f"No price data available for {', '.join(results.keys())}")
+            return results
+
+        for symbol in results:
+            # Multi-ticker downloads are keyed by (ticker, field) columns
+            if isinstance(raw.columns, pd.MultiIndex):
+                if symbol not in raw.columns.get_level_values(0):
+                    print(f"No price data available for {symbol}")
+                    continue
+                hist = raw[symbol]
+            else:
+                hist = raw
+
+            # Drop dates where this ticker did not trade (e.g. before listing)
+            hist = hist.dropna(subset=['Close'])
+
+            if hist.empty:
+                print(f"No price data available for {symbol}")
+                continue
+
+            results[symbol] = {
+                'price_data': self._add_moving_averages(hist.copy()),
+                'current_price': float(hist['Close'].iloc[-1])
+            }
+
+        return results
+
+    def _add_moving_averages(self, hist: pd.DataFrame) -> pd.DataFrame:
+        """Add 20/50/200-day moving averages to daily price data"""
+        # A single missing close would turn every later cumulative sum into NaN,
+        # so drop those rows first
+        hist = hist.dropna(subset=['Close'])
+
+        # All windows share one cumulative sum: mean = (cs[i] - cs[i - K]) / K
+        close = hist['Close'].to_numpy(dtype=float)
+        cumsum = np.concatenate(([0.0], np.cumsum(close)))
+
+        for window in MOVING_AVERAGE_WINDOWS:
+            ma = np.full(len(close), np.nan)
+            if len(close) >= window:
+                ma[window - 1:] = (cumsum[window:] - cumsum[:-window]) / window
+            hist[f'MA_{window}'] = ma
+
+        # Only keep rows with 200-day MA calculated
+        return hist.dropna(subset=['MA_200'])
+
     def get_current_price(self, symbol: str) -> Optional[float]:
         """Get current stock price"""
         try:
@@ -251,23 +243,25 @@ class YahooFinanceCollector:
             print(f"Error fetching current price for {symbol}: {e}")
             return None
 
-    def collect_bulk_data(self, symbols: List[str]) -> Dict[str, Dict[str, Any]]:
-        """Collect comprehensive data for multiple stocks"""
+    def _collect_one(self, symbol: str) -> Dict[str, Any]:
+        """Collect comprehensive data for a single stock"""
+        print(f"Collecting data for {symbol}...")
+
+        return {
+            'info': self.get_stock_info(symbol),
+            'fundamental_data': self.get_fundamental_data(symbol),
+            'price_data': self.get_daily_price_data(symbol),
+            'current_price': self.get_current_price(symbol)
+        }
+
+    def collect_bulk_data(self, symbols: List[str], max_workers: int = 8) -> Dict[str, Dict[str, Any]]:
+        """Collect comprehensive data for multiple stocks, fetching symbols concurrently"""
         results = {}
 
-        for symbol in symbols:
-            print(f"Collecting data for {symbol}...")
-
-            stock_info = self.get_stock_info(symbol)
-            fundamental_data = self.get_fundamental_data(symbol)
-            price_data = self.get_daily_price_data(symbol)
-            current_price = self.get_current_price(symbol)
-
-            results[symbol.upper()] = {
-                'info': stock_info,
-                'fundamental_data': fundamental_data,
-                'price_data': price_data,
-                'current_price': current_price
-            }
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {executor.submit(self._collect_one, symbol): symbol for symbol in symbols}
+
+            for future in as_completed(futures):
+                results[futures[future].upper()] = future.result()
 
-        return results
\ No newline at end of file
+        return results
@@ -1,18 +1,150 @@
 import sqlite3
+import threading
+import numpy as np
 import pandas as pd
-from datetime import datetime
-from typing import List, Dict, Any
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from typing import List, Dict, Any, Iterable
+
+# Statements run on every refresh, kept as constants so the connection's
+# statement cache sees the same SQL text each time and skips recompiling it
+_INSERT_STOCK_SQL = """
+    INSERT OR REPLACE INTO stocks (symbol, company_name, last_updated)
+    VALUES (?, ?, CURRENT_TIMESTAMP)
+"""
+
+_INSERT_FUND_SQL = """
+    INSERT OR REPLACE INTO fundamental_data
+    (symbol, quarter, year, revenue, operating_income, net_income,
+     total_assets, total_debt, shareholders_equity, cash_and_equivalents,
+     ebit_margin, roe, debt_to_equity)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+_INSERT_TECH_SQL = """
+    INSERT OR REPLACE INTO technical_data
+    (symbol, date, open_price, high_price, low_price, close_price,
+     volume, adj_close, ma_20, ma_50, ma_200)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+_INSERT_ANALYSIS_SQL = """
+    INSERT OR REPLACE INTO analysis_results
+    (symbol, revenue_growth_4q, avg_ebit_margin, ebit_margin_trend,
+     current_price, ma_20, ma_50, ma_200, price_vs_ma20, price_vs_ma50, price_vs_ma200,
+     ranking_score, recommendation, summary)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+_SELECT_FUND_SQL = """
+    SELECT quarter, year, revenue, operating_income, net_income,
+           total_assets, total_debt, shareholders_equity, cash_and_equivalents,
+           ebit_margin, roe, debt_to_equity
+    FROM fundamental_data
+    WHERE symbol = ?
+    ORDER BY year DESC, quarter DESC
+    LIMIT 4
+"""
+
+_SELECT_TECH_SQL = """
+    SELECT date, open_price, high_price, low_price, close_price,
+           volume, adj_close, ma_20, ma_50, ma_200
+    FROM technical_data
+    WHERE symbol = ?
+    ORDER BY date DESC
+"""
+
+_SELECT_TECH_LIMIT_SQL = _SELECT_TECH_SQL + "LIMIT ?"
+
+_SELECT_ANALYSIS_SQL = """
+    SELECT symbol, revenue_growth_4q, avg_ebit_margin, ebit_margin_trend,
+           current_price, ma_20, ma_50, ma_200, price_vs_ma20, price_vs_ma50, price_vs_ma200,
+           ranking_score, recommendation, summary
+    FROM analysis_results
+    ORDER BY ranking_score DESC
+"""
 
 class FinancialDatabase:
     def __init__(self, db_path: str = "financial_data.db"):
         self.db_path = db_path
+
+        # One long-lived connection instead of reopening the file on every call.
+        # The instance is shared by every Streamlit session, and each script run
+        # executes on its own thread, hence check_same_thread=False and a lock.
+        # The default isolation level is kept so executemany runs in a single
+        # implicit transaction rather than committing row by row.
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, cached_statements=256)
+        self._conn.executescript("""
+            PRAGMA journal_mode=WAL;
+            PRAGMA synchronous=NORMAL;
+            PRAGMA temp_store=MEMORY;
+            PRAGMA cache_size=-65536;
+        """)
+
+        # Serializes use of the connection across threads; batch() holds it for
+        # its whole transaction so other threads cannot interleave writes
+        self._lock = threading.RLock()
+
+        # Set while batch() holds a transaction open
+        self._in_batch = False
+
         self.init_database()
 
+    def close(self):
+        """Close the database connection"""
+        with self._lock:
+            self._conn.close()
+
+    @contextmanager
+    def batch(self):
+        """Group all writes made inside the block into a single transaction"""
+        with self._lock:
+            conn = self._conn
+            conn.execute("BEGIN IMMEDIATE")
+            self._in_batch = True
+            try:
+                yield self
+                conn.commit()
+            except BaseException:
+                conn.rollback()
+                raise
+            finally:
+                self._in_batch = False
+
+    @contextmanager
+    def _write(self):
+        """
+        Scope of a single write: committed on its own, or inside batch() kept
+        in the batch's transaction under a savepoint. Either way a failed write
+        is undone without leaving partial rows behind.
+        """
+        with self._lock:
+            conn = self._conn
+            if self._in_batch:
+                conn.execute("SAVEPOINT write")
+                try:
+                    yield
+                except BaseException:
+                    conn.execute("ROLLBACK TO write")
+                    raise
+                finally:
+                    conn.execute("RELEASE write")
+            else:
+                try:
+                    yield
+                    conn.commit()
+                except BaseException:
+                    conn.rollback()
+                    raise
+
     def init_database(self):
         """Initialize the database with required tables"""
-        conn = sqlite3.connect(self.db_path)
+        conn = self._conn
         cursor = conn.cursor()
 
+        # Remove the table used by older versions of the schema
+        cursor.execute("DROP TABLE IF EXISTS financial_data")
+
         # Create stocks table
         cursor.execute("""
             CREATE TABLE IF NOT EXISTS stocks (
@@ -90,195 +222,204 @@ class FinancialDatabase:
             )
         """)
 
+        # Indexes matching the ORDER BY of the read queries, so they are served
+        # by an index scan instead of a sort
+        cursor.execute("""
+            CREATE INDEX IF NOT EXISTS idx_fund_symbol_yq
+            ON fundamental_data (symbol, year DESC, quarter DESC)
+        """)
+        cursor.execute("""
+            CREATE INDEX IF NOT EXISTS idx_analysis_score
+            ON analysis_results (ranking_score DESC)
+        """)
+
         conn.commit()
-        conn.close()
+
+        # Refresh planner statistics so the indexes are used
+        cursor.execute("ANALYZE")
 
     def add_stock(self, symbol: str, company_name: str = None):
         """Add a stock to the database"""
-        conn = sqlite3.connect(self.db_path)
+        conn = self._conn
         cursor = conn.cursor()
 
         try:
-            cursor.execute("""
-                INSERT OR REPLACE INTO stocks (symbol, company_name, last_updated)
-                VALUES (?, ?, CURRENT_TIMESTAMP)
-            """, (symbol.upper(), company_name))
-            conn.commit()
+            with self._write():
+                cursor.execute(_INSERT_STOCK_SQL, (symbol.upper(), company_name))
         except sqlite3.Error as e:
             print(f"Error adding stock {symbol}: {e}")
-        finally:
-            conn.close()
 
-    def store_fundamental_data(self, symbol: str, fundamental_data: List[Dict[str, Any]]):
+    def store_fundamental_data(self, symbol: str, fundamental_data: pd.DataFrame):
         """Store quarterly fundamental data for a stock"""
-        conn = sqlite3.connect(self.db_path)
+        conn = self._conn
         cursor = conn.cursor()
 
         try:
-            for data in fundamental_data:
-                cursor.execute("""
-                    INSERT OR REPLACE INTO fundamental_data
-                    (symbol, quarter, year, revenue, operating_income, net_income,
-                     total_assets, total_debt, shareholders_equity, cash_and_equivalents,
-                     ebit_margin, roe, debt_to_equity)
-                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                """, (symbol.upper(), data['quarter'], data['year'], data['revenue'],
-                     data['operating_income'], data['net_income'], data['total_assets'],
-                     data['total_debt'], data['shareholders_equity'], data['cash_and_equivalents'],
-                     data['ebit_margin'], data['roe'], data['debt_to_equity']))
-            conn.commit()
+            # Build all rows up front and insert them in one statement; NaN values are stored as NULL
+            columns = ['quarter', 'year', 'revenue', 'operating_income', 'net_income',
+                       'total_assets', 'total_debt', 'shareholders_equity', 'cash_and_equivalents',
+                       'ebit_margin', 'roe', 'debt_to_equity']
+            rows = [(symbol.upper(),) + row
+                    for row in fundamental_data[columns].itertuples(index=False, name=None)]
+
+            with self._write():
+                cursor.executemany(_INSERT_FUND_SQL, rows)
         except sqlite3.Error as e:
             print(f"Error storing fundamental data for {symbol}: {e}")
-        finally:
-            conn.close()
 
     def store_technical_data(self, symbol: str, technical_data: pd.DataFrame):
         """Store daily technical data for a stock"""
-        conn = sqlite3.connect(self.db_path)
+        conn = self._conn
 
         try:
-            # Prepare dataframe for insertion
-            tech_data = technical_data.copy()
-            tech_data['symbol'] = symbol.upper()
-            tech_data = tech_data.reset_index()
-
-            # Rename columns to match database schema
-            column_mapping = {
-                'Date': 'date',
-                'Open': 'open_price',
-                'High': 'high_price',
-                'Low': 'low_price',
-                'Close': 'close_price',
-                'Volume': 'volume',
-                'Adj Close': 'adj_close',
-                'MA_20': 'ma_20',
-                'MA_50': 'ma_50',
-                'MA_200': 'ma_200'
-            }
-            tech_data = tech_data.rename(columns=column_mapping)
-
-            # Select only the columns we need
-            columns_to_insert = ['symbol', 'date', 'open_price', 'high_price', 'low_price',
-                               'close_price', 'volume', 'adj_close', 'ma_20', 'ma_50', 'ma_200']
-            tech_data = tech_data[columns_to_insert]
-
-            # Insert data
-            tech_data.to_sql('technical_data', conn, if_exists='append', index=False)
-            conn.commit()
+            # Build the rows to insert straight from the source columns, without
+            # copying, resetting the index or renaming the whole frame first
+            tech_data = pd.DataFrame({
+                'symbol': symbol.upper(),
+                # Same text format the dates were stored in before
+                'date': [date.isoformat(" ") for date in technical_data.index],
+                'open_price': technical_data['Open'].to_numpy(),
+                'high_price': technical_data['High'].to_numpy(),
+                'low_price': technical_data['Low'].to_numpy(),
+                'close_price': technical_data['Close'].to_numpy(),
+                'volume': technical_data['Volume'].to_numpy(),
+                'adj_close': (technical_data['Adj Close'].to_numpy()
+                              if 'Adj Close' in technical_data.columns else np.nan),
+                # Moving averages come from YahooFinanceCollector._add_moving_averages
+                'ma_20': technical_data['MA_20'].to_numpy(),
+                'ma_50': technical_data['MA_50'].to_numpy(),
+                'ma_200': technical_data['MA_200'].to_numpy(),
+            })
+
+            # Insert with executemany rather than DataFrame.to_sql, which commits
+            # on its own and would end an enclosing batch() transaction early
+            with self._write():
+                conn.executemany(_INSERT_TECH_SQL, tech_data.itertuples(index=False, name=None))
 
         except Exception as e:
             print(f"Error storing technical data for {symbol}: {e}")
-        finally:
-            conn.close()
+
+    def _read_frame(self, query: str, params: tuple = ()) -> pd.DataFrame:
+        """Run a query and build a DataFrame directly from the cursor rows"""
+        with self._lock:
+            cursor = self._conn.execute(query, params)
+            columns = [column[0] for column in cursor.description]
+            return pd.DataFrame.from_records(cursor, columns=columns, coerce_float=True)
 
     def get_fundamental_data(self, symbol: str) -> pd.DataFrame:
         """Retrieve quarterly fundamental data for a stock"""
-        conn = sqlite3.connect(self.db_path)
-
-        query = """
-            SELECT quarter, year, revenue, operating_income, net_income,
-                   total_assets, total_debt, shareholders_equity, cash_and_equivalents,
-                   ebit_margin, roe, debt_to_equity
-            FROM fundamental_data
-            WHERE symbol = ?
-            ORDER BY year DESC, quarter DESC
-            LIMIT 4
-        """
-
-        df = pd.read_sql_query(query, conn, params=(symbol.upper(),))
-        conn.close()
-
-        return df
+        return self._read_frame(_SELECT_FUND_SQL, (symbol.upper(),))
 
     def get_technical_data(self, symbol: str, days: int = None) -> pd.DataFrame:
         """Retrieve technical data for a stock"""
-        conn = sqlite3.connect(self.db_path)
-
         if days:
-            query = """
-                SELECT date, open_price, high_price, low_price, close_price,
-                       volume, adj_close, ma_20, ma_50, ma_200
-                FROM technical_data
-                WHERE symbol = ?
-                ORDER BY date DESC
-                LIMIT ?
-            """
-            df = pd.read_sql_query(query, conn, params=(symbol.upper(), days))
+            df = self._read_frame(_SELECT_TECH_LIMIT_SQL, (symbol.upper(), days))
         else:
-            query = """
-                SELECT date, open_price, high_price, low_price, close_price,
-                       volume, adj_close, ma_20, ma_50, ma_200
-                FROM technical_data
-                WHERE symbol = ?
-                ORDER BY date DESC
-            """
-            df = pd.read_sql_query(query, conn, params=(symbol.upper(),))
-
-        conn.close()
+            df = self._read_frame(_SELECT_TECH_SQL, (symbol.upper(),))
+
         return df
 
     def store_analysis_result(self, symbol: str, analysis: Dict[str, Any]):
         """Store analysis results for a stock"""
-        conn = sqlite3.connect(self.db_path)
+        self.store_analysis_results_batch([{**analysis, 'symbol': symbol}])
+
+    def store_analysis_results_batch(self, analyses: List[Dict[str, Any]]):
+        """Store analysis results for several stocks in one statement"""
+        conn = self._conn
         cursor = conn.cursor()
 
-        try:
-            cursor.execute("""
-                INSERT OR REPLACE INTO analysis_results
-                (symbol, revenue_growth_4q, avg_ebit_margin, ebit_margin_trend,
-                 current_price, ma_20, ma_50, ma_200, price_vs_ma20, price_vs_ma50, price_vs_ma200,
-                 ranking_score, recommendation, summary)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            """, (symbol.upper(), analysis.get('revenue_growth_4q'),
+        rows = [(analysis['symbol'].upper(), analysis.get('revenue_growth_4q'),
                  analysis.get('avg_ebit_margin'), analysis.get('ebit_margin_trend'),
                  analysis.get('current_price'), analysis.get('ma_20'), analysis.get('ma_50'),
                  analysis.get('ma_200'), analysis.get('price_vs_ma20'), analysis.get('price_vs_ma50'),
                  analysis.get('price_vs_ma200'), analysis.get('ranking_score'),
-                 analysis.get('recommendation'), analysis.get('summary')))
-            conn.commit()
+                 analysis.get('recommendation'), analysis.get('summary'))
+                for analysis in analyses]
+
+        try:
+            with self._write():
+                cursor.executemany(_INSERT_ANALYSIS_SQL, rows)
         except sqlite3.Error as e:
-            print(f"Error storing analysis for {symbol}: {e}")
-        finally:
-            conn.close()
+            symbols = ', '.join(row[0] for row in rows)
+            print(f"Error storing analysis for {symbols}: {e}")
 
     def get_all_analysis_results(self) -> pd.DataFrame:
         """Get all analysis results for ranking"""
-        conn = sqlite3.connect(self.db_path)
+        return self._read_frame(_SELECT_ANALYSIS_SQL)
+
+    def get_analyzed_symbols(self, fresher_than: timedelta = None) -> List[str]:
+        """
+        Get symbols with stored analysis results, optionally only recent ones.
+        Results built without price or fundamental data (a failed fetch) are
+        left out so those symbols are fetched again.
+        """
+        conn = self._conn
+        cursor = conn.cursor()
 
         query = """
-            SELECT symbol, revenue_growth_4q, avg_ebit_margin, ebit_margin_trend,
-                   current_price, ma_20, ma_50, ma_200, price_vs_ma20, price_vs_ma50, price_vs_ma200,
-                   ranking_score, recommendation, summary
-            FROM analysis_results
-            ORDER BY ranking_score DESC
+            SELECT DISTINCT symbol FROM analysis_results
+            WHERE current_price IS NOT NULL
+              AND (revenue_growth_4q IS NOT NULL OR avg_ebit_margin IS NOT NULL)
         """
 
-        df = pd.read_sql_query(query, conn)
-        conn.close()
+        with self._lock:
+            if fresher_than:
+                # created_at is stored in UTC, as is datetime('now')
+                cursor.execute(query + "AND created_at >= datetime('now', ?)",
+                               (f"-{int(fresher_than.total_seconds())} seconds",))
+            else:
+                cursor.execute(query)
 
-        return df
+            symbols = [row[0] for row in cursor.fetchall()]
 
-    def clear_database(self):
-        """Clear all data from the database and start fresh"""
-        conn = sqlite3.connect(self.db_path)
+        return symbols
+
+    def get_all_symbols(self) -> List[str]:
+        """Get all stock symbols in the database"""
+        conn = self._conn
         cursor = conn.cursor()
 
-        try:
-            # Drop all tables
-            cursor.execute("DROP TABLE IF EXISTS analysis_results")
-            cursor.execute("DROP TABLE IF EXISTS technical_data")
-            cursor.execute("DROP TABLE IF EXISTS fundamental_data")
-            cursor.execute("DROP TABLE IF EXISTS financial_data")  # Remove old table
-            cursor.execute("DROP TABLE IF EXISTS stocks")
+        with self._lock:
+            cursor.execute("SELECT symbol FROM stocks UNION SELECT symbol FROM analysis_results")
+            symbols = [row[0] for row in cursor.fetchall()]
 
-            conn.commit()
+        return symbols
 
-            # Recreate tables with new schema
-            self.init_database()
+    def delete_stocks(self, symbols: Iterable[str]):
+        """Delete all stored data for the given stocks"""
+        params = [(symbol.upper(),) for symbol in symbols]
+        if not params:
+            return
 
-            print("Database cleared and recreated successfully")
+        conn = self._conn
+        cursor = conn.cursor()
 
+        try:
+            with self._write():
+                cursor.executemany("DELETE FROM analysis_results WHERE symbol = ?", params)
+                cursor.executemany("DELETE FROM technical_data WHERE symbol = ?", params)
+                cursor.executemany("DELETE FROM fundamental_data WHERE symbol = ?", params)
+                cursor.executemany("DELETE FROM stocks WHERE symbol = ?", params)
         except sqlite3.Error as e:
-            print(f"Error clearing database: {e}")
-        finally:
-            conn.close()
\ No newline at end of file
+            print(f"Error deleting stocks: {e}")
+
+    def clear_database(self):
+        """Clear all data from the database and start fresh"""
+        conn = self._conn
+
+        with self._lock:
+            try:
+                # Empty the tables in one transaction; the schema and indexes stay as they are
+                with conn:
+                    conn.execute("DELETE FROM analysis_results")
+                    conn.execute("DELETE FROM technical_data")
+                    conn.execute("DELETE FROM fundamental_data")
+                    conn.execute("DELETE FROM stocks")
+
+                # Reclaim the freed pages (must run outside a transaction)
+                conn.execute("VACUUM")
+
+                print("Database cleared successfully")
+
+            except sqlite3.Error as e:
+                print(f"Error clearing database: {e}")
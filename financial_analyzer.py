@@ -1,25 +1,56 @@
+import bisect
 import pandas as pd
 import numpy as np
+from dataclasses import dataclass
+from operator import itemgetter
 from typing import Dict, List, Any, Optional
-from scipy import stats
+
+# Scoring tables: a value scores SCORE[i], where i is the number of
+# thresholds it meets or exceeds
+_GROWTH_THRESH = (0, 5, 10)              # Positive, good, excellent quarterly growth
+_GROWTH_SCORE = (0, 20, 30, 40)
+_MARGIN_THRESH = (5, 10, 15, 20, 25)     # Low, moderate, good, very good, excellent margins
+_MARGIN_SCORE = (0, 10, 20, 30, 35, 40)
+_MA50_RISING_SCORE = 20
+
+
+@dataclass
+class FundamentalArrays:
+    """
+    Quarterly fundamentals as contiguous float64 arrays, newest quarter first
+    (NaN where a value is missing)
+    """
+    revenue: np.ndarray
+    ebit_margin: np.ndarray
+
+
+def _to_soa(fundamental_data: pd.DataFrame) -> FundamentalArrays:
+    """
+    Convert the fundamentals frame once into the arrays the analyzers read
+    """
+    columns = fundamental_data.reindex(columns=['revenue', 'ebit_margin'])
+    return FundamentalArrays(
+        revenue=columns['revenue'].to_numpy(dtype=np.float64),
+        ebit_margin=columns['ebit_margin'].to_numpy(dtype=np.float64),
+    )
+
 
 class FinancialAnalyzer:
     def __init__(self):
         pass
 
-    def calculate_revenue_growth(self, fundamental_data: List[Dict[str, Any]]) -> Optional[float]:
+    def calculate_revenue_growth(self, fundamentals: FundamentalArrays) -> Optional[float]:
         """
-        Calculate quarterly revenue growth rate (QoQ)
+        Calculate quarterly revenue growth rate (QoQ).
+
+        fundamentals must be ordered newest quarter first, as returned by
+        both YahooFinanceCollector.get_fundamental_data and
+        FinancialDatabase.get_fundamental_data.
         """
-        if len(fundamental_data) < 2:
+        if len(fundamentals.revenue) < 2:
             return None
 
-        # Sort by year and quarter (newest first)
-        sorted_data = sorted(fundamental_data,
-                           key=lambda x: (x['year'], x['quarter']),
-                           reverse=True)
-
-        revenues = [d['revenue'] for d in sorted_data if d['revenue'] is not None]
+        revenues = fundamentals.revenue[~np.isnan(fundamentals.revenue)]
 
         if len(revenues) < 2:
             return None
@@ -34,24 +65,19 @@ class FinancialAnalyzer:
                 return None
 
             qoq_growth = ((current_quarter - previous_quarter) / previous_quarter) * 100
-            return round(qoq_growth, 2)
+            return float(qoq_growth)
         except:
             return None
 
-    def analyze_ebit_margin_trend(self, fundamental_data: List[Dict[str, Any]]) -> Dict[str, Any]:
+    def analyze_ebit_margin_trend(self, fundamentals: FundamentalArrays) -> Dict[str, Any]:
         """
         Get average EBIT margin from last 4 quarters
         """
-        if not fundamental_data:
-            return {'avg_margin': None}
-
-        margins = [d['ebit_margin'] for d in fundamental_data if d['ebit_margin'] is not None]
-
-        if not margins:
+        if np.isnan(fundamentals.ebit_margin).all():
             return {'avg_margin': None}
 
-        avg_margin = np.mean(margins)
-        return {'avg_margin': round(avg_margin, 2)}
+        avg_margin = np.nanmean(fundamentals.ebit_margin)
+        return {'avg_margin': float(avg_margin)}
 
     def analyze_technical_indicators(self, technical_data: pd.DataFrame, current_price: float) -> Dict[str, Any]:
         """
@@ -69,31 +95,33 @@ class FinancialAnalyzer:
             }
 
         try:
+            # Work on the raw arrays; only a couple of elements are needed
+            ma20 = technical_data['MA_20'].to_numpy(dtype=float)
+            ma50 = technical_data['MA_50'].to_numpy(dtype=float)
+            ma200 = technical_data['MA_200'].to_numpy(dtype=float)
+
             # Get most recent moving averages
-            latest_data = technical_data.iloc[-1]
-            ma_20 = latest_data['MA_20']
-            ma_50 = latest_data['MA_50']
-            ma_200 = latest_data['MA_200']
+            ma_20 = float(ma20[-1])
+            ma_50 = float(ma50[-1])
+            ma_200 = float(ma200[-1])
 
             # Calculate price vs moving averages
-            price_vs_ma20 = ((current_price - ma_20) / ma_20 * 100) if pd.notna(ma_20) else None
-            price_vs_ma50 = ((current_price - ma_50) / ma_50 * 100) if pd.notna(ma_50) else None
-            price_vs_ma200 = ((current_price - ma_200) / ma_200 * 100) if pd.notna(ma_200) else None
+            price_vs_ma20 = ((current_price - ma_20) / ma_20 * 100) if not np.isnan(ma_20) else None
+            price_vs_ma50 = ((current_price - ma_50) / ma_50 * 100) if not np.isnan(ma_50) else None
+            price_vs_ma200 = ((current_price - ma_200) / ma_200 * 100) if not np.isnan(ma_200) else None
 
             # Check if MA50 is rising (compare last 10 days)
-            ma50_rising = False
-            if len(technical_data) >= 10 and pd.notna(ma_50):
-                ma50_10_days_ago = technical_data.iloc[-10]['MA_50']
-                if pd.notna(ma50_10_days_ago) and ma_50 > ma50_10_days_ago:
-                    ma50_rising = True
+            ma50_10_days_ago = ma50[-10] if len(ma50) >= 10 else np.nan
+            ma50_rising = bool(ma_50 > ma50_10_days_ago)  # False if either is NaN
 
             return {
-                'ma_20': round(ma_20, 2) if pd.notna(ma_20) else None,
-                'ma_50': round(ma_50, 2) if pd.notna(ma_50) else None,
-                'ma_200': round(ma_200, 2) if pd.notna(ma_200) else None,
-                'price_vs_ma20': round(price_vs_ma20, 2) if price_vs_ma20 else None,
-                'price_vs_ma50': round(price_vs_ma50, 2) if price_vs_ma50 else None,
-                'price_vs_ma200': round(price_vs_ma200, 2) if price_vs_ma200 else None,
+                # Raw floats; values are only rounded for display
+                'ma_20': ma_20 if not np.isnan(ma_20) else None,
+                'ma_50': ma_50 if not np.isnan(ma_50) else None,
+                'ma_200': ma_200 if not np.isnan(ma_200) else None,
+                'price_vs_ma20': price_vs_ma20,
+                'price_vs_ma50': price_vs_ma50,
+                'price_vs_ma200': price_vs_ma200,
                 'ma50_rising': ma50_rising
             }
 
@@ -122,45 +150,28 @@ class FinancialAnalyzer:
 
         # 1. Revenue growth QoQ scoring (0-40 points)
         if revenue_growth is not None:
-            if revenue_growth >= 10:  # Excellent quarterly growth
-                score += 40
-            elif revenue_growth >= 5:  # Good growth
-                score += 30
-            elif revenue_growth >= 0:  # Positive growth
-                score += 20
-            else:  # Negative growth
-                score += 0
+            score += _GROWTH_SCORE[bisect.bisect_right(_GROWTH_THRESH, revenue_growth)]
 
         # 2. EBIT margin scoring (0-40 points)
         avg_margin = ebit_analysis.get('avg_margin')
         if avg_margin is not None:
-            if avg_margin >= 25:  # Excellent margins
-                score += 40
-            elif avg_margin >= 20:  # Very good margins
-                score += 35
-            elif avg_margin >= 15:  # Good margins
-                score += 30
-            elif avg_margin >= 10:  # Moderate margins
-                score += 20
-            elif avg_margin >= 5:  # Low margins
-                score += 10
-            else:  # Negative or very low margins
-                score += 0
+            score += _MARGIN_SCORE[bisect.bisect_right(_MARGIN_THRESH, avg_margin)]
 
         # 3. Rising MA50 scoring (0-20 points)
         ma50_rising = technical_analysis.get('ma50_rising', False)
         if ma50_rising:
-            score += 20
+            score += _MA50_RISING_SCORE
 
-        return round(score, 1)
+        return score
 
-    def analyze_stock(self, symbol: str, fundamental_data: List[Dict[str, Any]],
+    def analyze_stock(self, symbol: str, fundamental_data: pd.DataFrame,
                      technical_data: pd.DataFrame, current_price: float) -> Dict[str, Any]:
         """
         Perform simplified analysis for a single stock
         """
-        revenue_growth = self.calculate_revenue_growth(fundamental_data)
-        ebit_analysis = self.analyze_ebit_margin_trend(fundamental_data)
+        fundamentals = _to_soa(fundamental_data)
+        revenue_growth = self.calculate_revenue_growth(fundamentals)
+        ebit_analysis = self.analyze_ebit_margin_trend(fundamentals)
         technical_analysis = self.analyze_technical_indicators(technical_data, current_price)
         ranking_score = self.calculate_ranking_score(revenue_growth, ebit_analysis, technical_analysis)
 
@@ -196,14 +207,17 @@ class FinancialAnalyzer:
         """
         Rank stocks based on their analysis scores
         """
-        # Sort by ranking score (highest first)
-        ranked_stocks = sorted(analysis_results,
-                             key=lambda x: x['ranking_score'],
-                             reverse=True)
+        # Scores were already computed per stock by analyze_stock
+        scores = np.array(list(map(itemgetter('ranking_score'), analysis_results)), dtype=float)
+
+        # Sort by ranking score (highest first); a stable sort on the negated
+        # scores keeps tied stocks in their original order
+        order = np.argsort(-scores, kind='stable')
+        ranked_stocks = [analysis_results[i] for i in order]
 
         # Add rank position
-        for i, stock in enumerate(ranked_stocks):
-            stock['rank'] = i + 1
+        for rank, stock in enumerate(ranked_stocks, start=1):
+            stock['rank'] = rank
 
         return ranked_stocks
 
@@ -224,13 +238,13 @@ class FinancialAnalyzer:
 
         # Revenue growth (QoQ)
         if revenue_growth is not None:
-            summary_parts.append(f"Revenue growth QoQ: {revenue_growth}%")
+            summary_parts.append(f"Revenue growth QoQ: {revenue_growth:.2f}%")
         else:
             summary_parts.append("Revenue growth: No data")
 
         # EBIT margin
         if avg_margin is not None:
-            summary_parts.append(f"EBIT margin: {avg_margin}%")
+            summary_parts.append(f"EBIT margin: {avg_margin:.2f}%")
         else:
             summary_parts.append("EBIT margin: No data")
 
@@ -240,6 +254,6 @@ class FinancialAnalyzer:
         else:
             summary_parts.append("MA50: Not rising")
 
-        summary_parts.append(f"Score: {score}/100 - {recommendation}")
+        summary_parts.append(f"Score: {score:.1f}/100 - {recommendation}")
 
         return ". ".join(summary_parts) + "."
\ No newline at end of file